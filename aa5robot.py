@@ -4,22 +4,103 @@ import time
 import re
 import logging
 import json
+import math
+import threading
+import contextvars
+import collections
+import concurrent.futures
 
 from slackclient import SlackClient
 
 import command
+import botlog
+from command.deadline import Deadline, DeadlineExceeded, set_deadline, reset_deadline
 
 RTM_READ_DELAY = 1           # number of seconds to wait between reads of Slack RTM
 MAX_RECONNECT_ATTEMPTS = 5   # number of attempts to reconnect to Slack before exiting
 RECONNECT_WAIT_TIME = 5      # time to wait between reconnect attempts (seconds)
+COMMAND_DEADLINE = 15        # time a command has to finish before it gives up (seconds)
+ACK_DELAY = 1                # time to wait for a command before posting a "looking it up" message (seconds)
+COMMAND_WORKERS = 4          # number of commands that can run at the same time
+SHUTDOWN_WAIT = 5            # time to wait for running commands when shutting down (seconds)
+LATENCY_WINDOW = 500         # number of recent latency samples used for percentiles
+LATENCY_REPORT_INTERVAL = 20 # number of commands between latency reports
 
 logger = logging.getLogger(__name__)
 
+class LatencyTracker:
+    """
+    Keeps a window of recent latency samples and periodically logs percentiles.
+    """
+    def __init__(self, name, window=LATENCY_WINDOW, report_interval=LATENCY_REPORT_INTERVAL):
+        self.name = name
+        self.samples = collections.deque(maxlen=window)
+        self.report_interval = report_interval
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        """
+        Adds a latency sample (seconds), logging a report every report_interval samples.
+        """
+        with self.lock:
+            self.samples.append(latency)
+            self.count += 1
+            report = self.count % self.report_interval == 0
+
+        if report:
+            self.report()
+
+    def percentile(self, pct):
+        """
+        Returns the pct percentile (nearest rank) of the recorded samples, or None if there are none.
+        """
+        with self.lock:
+            samples = sorted(self.samples)
+
+        if not samples:
+            return None
+        return samples[max(0, math.ceil(pct / 100 * len(samples)) - 1)]
+
+    def report(self):
+        p50 = self.percentile(50)
+        p99 = self.percentile(99)
+        if p99 is None:
+            return
+        logger.info('%s latency over last %d commands: p50 %.2fs, p99 %.2fs', self.name, len(self.samples), p50, p99,
+                    extra={'latency_name': self.name, 'p50': p50, 'p99': p99})
+
+class PendingReply:
+    """
+    Tracks the placeholder message for a slow command.  Either the command's
+    response or the deadline timer replies, whichever claims it first.
+    """
+    def __init__(self, channel, placeholder_ts, ts):
+        self.channel = channel
+        self.placeholder_ts = placeholder_ts
+        self.ts = ts
+        self.timer = None
+        self.replied = False
+        self.lock = threading.Lock()
+
+    def claim(self):
+        """
+        Returns True the first time it's called, False after that.
+        """
+        with self.lock:
+            if self.replied:
+                return False
+            self.replied = True
+            return True
+
 class AA5ROBot:
     """
     A Slack bot for the AARO Slack site.
     """
-    def __init__(self):
+    def __init__(self, log_listener=None):
+        # QueueListener writing log records, stopped on shutdown to flush them
+        self.log_listener = log_listener
+
         # Get the Bot token from the environment.  Raises RunTimeError if the
         # value isn't set because the bot can't run without a token configured.
         slack_bot_token = os.environ.get('SLACK_BOT_TOKEN')
@@ -40,7 +121,18 @@ class AA5ROBot:
         # Load the bot's commands
         self.commands = command.get_commands()
 
-        print('AA5RObot initialized.')
+        # Commands run on worker threads so a slow upstream never blocks the RTM loop
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=COMMAND_WORKERS)
+        self.in_flight = set()
+        self.in_flight_lock = threading.Lock()
+        self.shutting_down = False
+
+        # "perceived" is the time until the user sees any reply, "complete" is
+        # the time until the final answer is posted
+        self.perceived_latency = LatencyTracker('Perceived reply')
+        self.complete_latency = LatencyTracker('Complete reply')
+
+        logger.info('AA5RObot initialized.')
 
     def start(self):
         reconnects = 0
@@ -59,9 +151,9 @@ class AA5ROBot:
         # If execution gets here, the connection to the server was interrupted.
         # Attempt up to MAX_RECONNECT_ATTEMPTS tries to reconnect to Slack.
         while reconnects < MAX_RECONNECT_ATTEMPTS:
-            print('AA5RObot lost connection to Slack.  Attempting reconnect, try {}'.format(reconnects + 1))
+            logger.warning('AA5RObot lost connection to Slack.  Attempting reconnect, try %d', reconnects + 1)
             if self.slack_client.rtm_connect(with_team_state=False):
-                print("AA5ROBot reconnected to Slack.")
+                logger.info("AA5ROBot reconnected to Slack.")
                 self.aa5robot_id = slack_client.api_call("auth.test")["user_id"]
                 self.start()
             else:
@@ -69,19 +161,29 @@ class AA5ROBot:
                 time.sleep(RECONNECT_WAIT_TIME)
         
         # Bot was unable to reconnect, so end the process.
-        print('Unable to reconnect to Slack.  Exiting.')
+        logger.error('Unable to reconnect to Slack.  Exiting.')
         self.shutdown(1)
 
     def shutdown(self, exit_code = 0):
         """
         Execute cleanup tasks before exiting the process.
         """
+        # Stop replying to Slack, drop queued commands and give running ones
+        # a short time to finish before their resources are closed.
+        self.shutting_down = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self.in_flight_lock:
+            running = list(self.in_flight)
+        concurrent.futures.wait(running, timeout=SHUTDOWN_WAIT)
+
         # call shutdown method on all command instances
         for instance in self.commands:
             instance[1].shutdown()
         
         # end the process
-        print("AA5ROBot exiting.")
+        logger.info("AA5ROBot exiting.")
+        if self.log_listener:
+            self.log_listener.stop()
         sys.exit(exit_code)
 
     def parse_bot_commands(self, slack_events):
@@ -114,7 +216,15 @@ class AA5ROBot:
         """
             Executes a bot command.
         """
-        logger.debug('channel: {}, data: {}, user: {}, ts: {}'.format(channel, data, user, ts))
+        # tag all log records for this command with the message's timestamp
+        token = botlog.set_request_id(ts)
+        try:
+            self._handle_command(data, channel, user, ts)
+        finally:
+            botlog.reset_request_id(token)
+
+    def _handle_command(self, data, channel, user, ts):
+        logger.debug('channel: %s, data: %s, user: %s', channel, data, user, extra={'channel': channel, 'user': user})
 
         # get command string
         try:
@@ -133,19 +243,128 @@ class AA5ROBot:
 
         command_strings = [i[0] for i in self.commands]
         if command_str in command_strings:
-            logger.info("Executing command '{}'.".format(command_str))
-            method, response = self.commands[command_strings.index(command_str)][1].do_command(data)
-
-            if method == command.MessageTypes.RTM_MESSAGE:
-                self.send_message(channel, response)
-            
-            if method == command.MessageTypes.API_CALL:
-                self.chat_post_message(channel, response)
-
+            logger.info("Executing command '%s'.", command_str, extra={'command': command_str})
+            self.run_command(self.commands[command_strings.index(command_str)][1], data, channel, ts)
         else:
             self.send_message(channel, "Not sure what you mean.  Tell me 'help' for more info.")
             return
 
+    def run_command(self, instance, data, channel, ts):
+        """
+        Runs a command on a worker thread with a deadline.  If the command
+        doesn't finish within ACK_DELAY, a placeholder message is posted and
+        updated in place once the command's response is ready, or with a
+        "took too long" reply if the deadline passes first.
+        """
+        # the deadline starts when the command is received and is visible to
+        # the command's upstream requests through command.deadline
+        deadline = Deadline(COMMAND_DEADLINE)
+        token = set_deadline(deadline)
+        try:
+            future = self.executor.submit(contextvars.copy_context().run, self._do_command, instance, data)
+        finally:
+            reset_deadline(token)
+
+        with self.in_flight_lock:
+            self.in_flight.add(future)
+        future.add_done_callback(self._discard_in_flight)
+
+        try:
+            method, response = future.result(timeout=ACK_DELAY)
+        except concurrent.futures.TimeoutError:
+            logger.info("Command '%s' is slow, posting placeholder reply.", instance.command)
+            placeholder_ts = self.chat_post_text(channel, "Looking it up\u2026")
+            self.perceived_latency.record(self._latency_since(ts))
+
+            # the timer and the done callback each run in their own copy of
+            # the context so their log records keep the request ID
+            pending = PendingReply(channel, placeholder_ts, ts)
+            pending.timer = threading.Timer(deadline.remaining(), contextvars.copy_context().run,
+                                            args=(self._expire_reply, future, pending, instance))
+            pending.timer.daemon = True
+            pending.timer.start()
+            reply_context = contextvars.copy_context()
+            future.add_done_callback(lambda f: reply_context.run(self._finish_reply, f, pending))
+            return
+
+        self.send_response(channel, method, response)
+        latency = self._latency_since(ts)
+        self.perceived_latency.record(latency)
+        self.complete_latency.record(latency)
+
+    def _do_command(self, instance, data):
+        """
+        Runs a command's do_command method, turning failures into a reply.
+        """
+        try:
+            return instance.do_command(data)
+        except DeadlineExceeded:
+            logger.info("Command '%s' ran past its deadline.", instance.command)
+            return (command.MessageTypes.RTM_MESSAGE, "Sorry, that took too long.  Try again later.")
+        except Exception:
+            logger.exception("Command '%s' failed.", instance.command)
+            return (command.MessageTypes.RTM_MESSAGE, "Sorry, something went wrong.")
+
+    def _discard_in_flight(self, future):
+        with self.in_flight_lock:
+            self.in_flight.discard(future)
+
+    def _finish_reply(self, future, pending):
+        """
+        Replaces the placeholder message with a slow command's response.
+        """
+        pending.timer.cancel()
+        if future.cancelled() or self.shutting_down:
+            return
+        if not pending.claim():
+            logger.info('Discarding response that arrived after the deadline.')
+            return
+
+        try:
+            method, response = future.result()
+            self._send_pending_reply(pending, method, response)
+        except Exception:
+            logger.exception('Failed to send response to Slack.')
+        finally:
+            self.complete_latency.record(self._latency_since(pending.ts))
+
+    def _expire_reply(self, future, pending, instance):
+        """
+        Replaces the placeholder message with a "took too long" reply when a
+        command is still running at its deadline.
+        """
+        # a finished command's done callback sends the real response
+        if future.done() or self.shutting_down or not pending.claim():
+            return
+
+        logger.info("Command '%s' ran past its deadline.", instance.command)
+        future.cancel()
+        try:
+            self._send_pending_reply(pending, command.MessageTypes.RTM_MESSAGE, "Sorry, that took too long.  Try again later.")
+        except Exception:
+            logger.exception('Failed to send response to Slack.')
+        finally:
+            self.complete_latency.record(self._latency_since(pending.ts))
+
+    def _send_pending_reply(self, pending, method, response):
+        """
+        Sends the reply for a command that had a placeholder message posted.
+        """
+        if pending.placeholder_ts:
+            self.chat_update(pending.channel, pending.placeholder_ts, method, response)
+        elif method == command.MessageTypes.API_CALL:
+            # placeholder couldn't be posted, so send the response as a new message
+            self.chat_post_message(pending.channel, response)
+        else:
+            self.chat_post_text(pending.channel, response)
+
+    def _latency_since(self, ts):
+        """
+        Returns seconds elapsed since the Slack message with timestamp ts was
+        sent, which includes the time spent waiting for the next RTM read.
+        """
+        return max(0.0, time.time() - float(ts))
+
     def handle_help(self, channel, ts):
         """
         Sends the bot's help message to Slack.
@@ -164,6 +383,16 @@ class AA5ROBot:
             text=help_text
         )
 
+    def send_response(self, channel, method, response):
+        """
+        Send a command's response using the method it asked for.
+        """
+        if method == command.MessageTypes.RTM_MESSAGE:
+            self.send_message(channel, response)
+
+        if method == command.MessageTypes.API_CALL:
+            self.chat_post_message(channel, response)
+
     def send_message(self, channel, response):
         """
         Send a text-only response via the RTM API.
@@ -181,9 +410,48 @@ class AA5ROBot:
             attachments=json.dumps(response)
         )
 
+    def chat_post_text(self, channel, text):
+        """
+        Send a text-only chat.postMessage API call.  Returns the posted
+        message's timestamp, or None if the message wasn't sent.
+        """
+        result = self.slack_client.api_call(
+            "chat.postMessage",
+            channel=channel,
+            as_user=True,
+            text=text
+        )
+        return result.get("ts") if result.get("ok") else None
+
+    def chat_update(self, channel, ts, method, response):
+        """
+        Replace the text of a previously posted message with a command's response.
+        """
+        if method == command.MessageTypes.API_CALL:
+            self.slack_client.api_call(
+                "chat.update",
+                channel=channel,
+                ts=ts,
+                as_user=True,
+                text="",
+                attachments=json.dumps(response)
+            )
+        else:
+            self.slack_client.api_call(
+                "chat.update",
+                channel=channel,
+                ts=ts,
+                as_user=True,
+                text=response
+            )
+
 def main():
+    # set up logging before the bot connects to Slack.  Records logged while
+    # the command package is imported (and its command instances created)
+    # happen before this and go to Python's default stderr handler.
+    log_listener = botlog.configure_logging()
     # create the AA5RObot instance
-    aa5robot = AA5ROBot()
+    aa5robot = AA5ROBot(log_listener)
     # start processing commands
     aa5robot.start()
 
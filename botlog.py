@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import time
+import queue
+import random
+import logging
+import logging.handlers
+import contextvars
+
+# Slack message timestamp of the request currently being processed.  Used as a
+# correlation ID so every log record for a single command can be grouped.
+# NO_REQUEST_ID is used for records logged outside of a command.
+NO_REQUEST_ID = '-'
+_request_id = contextvars.ContextVar('request_id', default=NO_REQUEST_ID)
+
+# attributes present on every LogRecord, anything else was passed in 'extra'
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'request_id'}
+
+def set_request_id(request_id):
+    """
+    Sets the correlation ID for log records emitted from the current context.
+    Returns a token that must be passed to reset_request_id().
+    """
+    return _request_id.set(request_id)
+
+def reset_request_id(token):
+    """
+    Restores the correlation ID that was active before set_request_id().
+    """
+    _request_id.reset(token)
+
+class RequestIdFilter(logging.Filter):
+    """
+    Adds the current request's correlation ID to each log record.
+    """
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that queues records without formatting them, so formatting
+    happens on the listener's thread and exc_info reaches the formatter.  This
+    is only safe because the queue is in-process.
+    """
+    def prepare(self, record):
+        return record
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes only a fraction of DEBUG records.  Records at INFO and above are
+    never dropped.
+    """
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as a single line JSON object.  Fields passed to the
+    logger with 'extra' are included as top-level keys.
+    """
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + '.{:03d}Z'.format(int(record.msecs)),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+
+        request_id = getattr(record, 'request_id', NO_REQUEST_ID)
+        if request_id != NO_REQUEST_ID:
+            entry['request_id'] = request_id
+
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+def configure_logging():
+    """
+    Configures the root logger from the environment and returns the started
+    QueueListener.  Records are handed to a queue on the calling thread and
+    written to stdout by the listener's thread, so logging never blocks the
+    RTM loop on I/O.  Call stop() on the returned listener before exiting to
+    flush pending records.
+
+    LOG_LEVEL - minimum level to log (default INFO)
+    LOG_FORMAT - 'json' for structured output, anything else for plain text
+    LOG_DEBUG_SAMPLE_RATE - fraction of DEBUG records to keep (default 1.0)
+    """
+    # invalid settings fall back to their defaults, warnings are logged once
+    # logging is configured
+    warnings = []
+
+    level = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    if not isinstance(logging.getLevelName(level), int):
+        warnings.append(('Invalid LOG_LEVEL %r, using INFO.', level))
+        level = 'INFO'
+
+    log_format = os.environ.get('LOG_FORMAT', 'text').lower()
+
+    sample_rate_str = os.environ.get('LOG_DEBUG_SAMPLE_RATE', '1.0')
+    try:
+        sample_rate = float(sample_rate_str)
+    except ValueError:
+        sample_rate = None
+    if sample_rate is None or not 0.0 <= sample_rate <= 1.0:
+        warnings.append(('Invalid LOG_DEBUG_SAMPLE_RATE %r, must be between 0.0 and 1.0.  Using 1.0.', sample_rate_str))
+        sample_rate = 1.0
+
+    if log_format == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s')
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    # filters run on the caller's thread, so the correlation ID is captured
+    # before the record is queued and sampled out records are never queued
+    queue_handler = LazyQueueHandler(queue.Queue(-1))
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    listener.start()
+
+    for message, value in warnings:
+        logging.getLogger(__name__).warning(message, value)
+
+    return listener
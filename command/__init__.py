@@ -33,13 +33,13 @@ for module, klass in commands:
     try:
         m = importlib.import_module(module)
     except ImportError:
-        logging.warning('Failed to import module {}'.format(module))
+        logging.warning('Failed to import module %s', module)
         continue
 
     try:
         command_instances.append(getattr(m, klass)())
     except RuntimeError:
-        logging.warning('Failed to create instance of {}'.format(klass))
+        logging.warning('Failed to create instance of %s', klass)
         continue
 
 def get_commands():
@@ -7,9 +7,12 @@ import requests
 
 from . import MessageTypes
 from .command import Command
+from .deadline import request_timeout
 
 logger = logging.getLogger(__name__)
 
+REQUEST_TIMEOUT = 10    # upper bound on a callook.info request (seconds)
+
 class CommandCall(Command):
     """
     AA5RObot command to lookup information on a callsign and display the info
@@ -31,9 +34,17 @@ class CommandCall(Command):
         except IndexError:
             return (MessageTypes.RTM_MESSAGE, "You need to give me a callsign!\nCommand looks like: {}".format(self.syntax))
         
-        logger.info('Running lookup for callsign {}...'.format(callsign))
+        logger.info('Running lookup for callsign %s...', callsign, extra={'callsign': callsign})
+
+        try:
+            call_info = self._lookup_call(callsign)
+        except requests.exceptions.Timeout:
+            logger.info('Lookup for callsign %s timed out.', callsign)
+            return (MessageTypes.RTM_MESSAGE, "callook.info took too long to answer for {}.  Try again later.".format(callsign))
+        except requests.exceptions.RequestException:
+            logger.info('Error getting data from callook.info.')
+            return (MessageTypes.RTM_MESSAGE, "Error getting data from callook.info.")
 
-        call_info = self._lookup_call(callsign)
         if call_info:
             try:
                 # create location string
@@ -83,13 +94,16 @@ class CommandCall(Command):
 
     def _lookup_call(self, callsign):
         """
-        Request callsign info from callook.info.
+        Request callsign info from callook.info.  The request is bounded by the
+        current command's deadline.
         """
+        timeout = request_timeout(REQUEST_TIMEOUT)
+
         # make request to callook.info
         if self.USER_AGENT:
-            request = requests.get('https://callook.info/{}/json'.format(callsign), headers={'user-agent': USER_AGENT})
+            request = requests.get('https://callook.info/{}/json'.format(callsign), headers={'user-agent': self.USER_AGENT}, timeout=timeout)
         else:
-            request = requests.get('https://callook.info/{}/json'.format(callsign))
+            request = requests.get('https://callook.info/{}/json'.format(callsign), timeout=timeout)
     
         # check returned data, return result if ok
         if request.ok:
@@ -0,0 +1,56 @@
+import time
+import contextvars
+
+# deadline for the command currently being processed
+_current_deadline = contextvars.ContextVar('deadline', default=None)
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a command runs out of time before it can finish.
+    """
+    pass
+
+class Deadline:
+    """
+    A point in time by which a command must have replied.
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires = time.monotonic() + budget
+
+    def remaining(self):
+        """
+        Returns the number of seconds left before the deadline, never negative.
+        """
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.remaining() == 0.0
+
+def set_deadline(deadline):
+    """
+    Sets the deadline for commands run from the current context.  Returns a
+    token that must be passed to reset_deadline().
+    """
+    return _current_deadline.set(deadline)
+
+def reset_deadline(token):
+    """
+    Restores the deadline that was active before set_deadline().
+    """
+    _current_deadline.reset(token)
+
+def request_timeout(default):
+    """
+    Returns the timeout (seconds) to use for an upstream request.  This is the
+    time left before the current command's deadline, or default if no deadline
+    is set.  Raises DeadlineExceeded if the deadline has already passed.
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default
+
+    if deadline.expired():
+        raise DeadlineExceeded()
+
+    return min(default, deadline.remaining())
@@ -5,9 +5,12 @@ import requests
 
 from . import MessageTypes
 from .command import Command
+from .deadline import request_timeout
 
 logger = logging.getLogger(__name__)
 
+REQUEST_TIMEOUT = 10    # upper bound on an aprs.fi request (seconds)
+
 class CommandLocation(Command):
     """
     AA5RObot command to get an SSID's last reported location.
@@ -34,8 +37,16 @@ class CommandLocation(Command):
         except IndexError:
             return (MessageTypes.RTM_MESSAGE, "You need to give me a SSID!\nCommand looks like: {}".format(self.syntax))
 
-        logger.info('Making request to aprs.fi for latest location of {}.'.format(ssid))
-        request = requests.get('https://api.aprs.fi/api/get?name={}&what=loc&apikey={}&format=json'.format(ssid.upper(), self.aprs_fi_token), headers={'user-agent': self.user_agent})
+        logger.info('Making request to aprs.fi for latest location of %s.', ssid, extra={'ssid': ssid})
+        try:
+            request = requests.get('https://api.aprs.fi/api/get?name={}&what=loc&apikey={}&format=json'.format(ssid.upper(), self.aprs_fi_token),
+                                   headers={'user-agent': self.user_agent}, timeout=request_timeout(REQUEST_TIMEOUT))
+        except requests.exceptions.Timeout:
+            logger.info('Request to aprs.fi for %s timed out.', ssid)
+            return (MessageTypes.RTM_MESSAGE, "aprs.fi took too long to answer.  Try again later.")
+        except requests.exceptions.RequestException:
+            logger.info('Error getting data from aprs.fi.')
+            return (MessageTypes.RTM_MESSAGE, "Error getting data from aprs.fi.")
 
         if request.ok:
             try:
@@ -53,7 +64,7 @@ class CommandLocation(Command):
                 return (MessageTypes.RTM_MESSAGE, "Error parsing data from aprs.fi.")
 
             if result["found"] == 0:
-                logger.info("There is no location info for {}.".format(ssid))
+                logger.info("There is no location info for %s.", ssid)
                 return (MessageTypes.RTM_MESSAGE, "There is no location info for that SSID.")
 
             try:
@@ -84,8 +95,11 @@ class CommandLocation(Command):
                     }
                 ]
 
-                logger.info('Successfully retrieved latest location of {}'.format(ssid))
+                logger.info('Successfully retrieved latest location of %s', ssid)
                 return (MessageTypes.API_CALL, response)
             except KeyError:
                 logger.info('Error parsing data from aprs.fi.')
                 return (MessageTypes.RTM_MESSAGE, "Error parsing data from aprs.fi.")
+
+        logger.info('Error getting data from aprs.fi.')
+        return (MessageTypes.RTM_MESSAGE, "Error getting data from aprs.fi.")
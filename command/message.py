@@ -1,5 +1,6 @@
 import os
 import logging
+import threading
 
 import aprslib
 
@@ -37,6 +38,10 @@ class CommandMessage(Command):
         # instance variable to track message IDs
         self.message_id = 1
 
+        # commands run on worker threads, so serialize use of the APRS-IS
+        # connection and message IDs
+        self.lock = threading.Lock()
+
     def shutdown(self):
         logger.info('Shutting down APRS-IS connection.')
         self.ais.close()
@@ -64,12 +69,13 @@ class CommandMessage(Command):
         if len(message) > 67:
             return (MessageTypes.RTM_MESSAGE, "Sorry that message is too long to send via APRS.")
 
-        # create APRS-IS packet
-        aprs_packet = "{}>{},TCPIP::{:<9}:{}{{{}".format(self.APRS_CALLSIGN, self.APRS_CALLSIGN, ssid, message, self.message_id)
-        
-        # send packet to APRS-IS
-        logger.info("Sending APRS packet: {}".format(aprs_packet))
-        self.ais.sendall(aprs_packet)
-        self.message_id += 1
+        with self.lock:
+            # create APRS-IS packet
+            aprs_packet = "{}>{},TCPIP::{:<9}:{}{{{}".format(self.APRS_CALLSIGN, self.APRS_CALLSIGN, ssid, message, self.message_id)
+
+            # send packet to APRS-IS
+            logger.info("Sending APRS packet: %s", aprs_packet, extra={'ssid': ssid})
+            self.ais.sendall(aprs_packet)
+            self.message_id += 1
 
         return (MessageTypes.RTM_MESSAGE, "Sent!")